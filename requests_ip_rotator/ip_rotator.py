@@ -1,13 +1,67 @@
 import concurrent.futures
-import ipaddress
-from random import choice, randint
-from time import sleep
+import itertools
+import json
+import os
+import socket
+import tempfile
+import threading
+from functools import lru_cache
+from random import Random
+from time import monotonic, sleep, time
+from urllib.parse import urlsplit
 
-import boto3
-import botocore.exceptions
 import requests as rq
+from urllib3.connection import HTTPConnection
 
-MAX_IPV4 = ipaddress.IPv4Address._ALL_ONES
+# Outbound sockets keep Nagle disabled (urllib3's default) and are kept alive
+# between requests to the same endpoint
+_SOCKET_OPTIONS = HTTPConnection.default_socket_options + [
+    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+]
+
+# Single botocore session shared by every gateway, so service models and
+# credential resolvers are only loaded once per process. botocore itself is
+# only imported once a client is needed, keeping this module quick to import
+# for code that just sends through known endpoints.
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+# Client config giving enough pooled connections for every region thread to
+# keep its TLS session warm, failing fast on unreachable regions, with
+# throttling handled by botocore's adaptive retry mode
+_CLIENT_CONFIG = {
+    "max_pool_connections": 32,
+    "tcp_keepalive": True,
+    "connect_timeout": 3,
+    "read_timeout": 30,
+    "retries": {
+        "max_attempts": 10,
+        "mode": "adaptive"
+    }
+}
+
+# Listings of existing gateways, keyed on (region, access key id), so that
+# back-to-back start/shutdown calls don't list every region twice
+_GATEWAY_CACHE = {}
+_GATEWAY_CACHE_TTL = 20 * 60
+
+# How long to keep retrying a throttled gateway deletion, and how long to
+# wait between tries
+_DELETE_DEADLINE = 5 * 60
+_DELETE_RETRY_DELAY = 5
+
+# Endpoints persisted between runs, as {api_name: {key_id: {region: [endpoint, created]}}},
+# with "" as the key id for credentials from the environment or a profile
+ENDPOINT_CACHE_PATH = os.path.expanduser("~/.cache/requests-ip-rotator/endpoints.json")
+_ENDPOINT_CACHE_TTL = 20 * 60
+_ENDPOINT_CACHE_LOCK = threading.Lock()
+
+# Per-thread batches of random addresses for X-Forwarded-For
+_XFF_BATCH_SIZE = 1024
+_xff_local = threading.local()
+
+# Ways send() can pick an endpoint for each request
+ROTATIONS = ["random", "roundrobin", "sticky"]
 
 # Region lists that can be imported and used in the ApiGateway class
 DEFAULT_REGIONS = [
@@ -29,10 +83,191 @@ ALL_REGIONS = EXTRA_REGIONS + [
 ]
 
 
+@lru_cache(maxsize=None)
+def _get_client(region, key_id, secret):
+    global _SESSION
+    import botocore.config
+    import botocore.session
+    # Clients are thread safe once created, but the session creating them is not
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            _SESSION = botocore.session.get_session()
+        return _SESSION.create_client(
+            "apigateway",
+            region_name=region,
+            aws_access_key_id=key_id,
+            aws_secret_access_key=secret,
+            config=botocore.config.Config(**_CLIENT_CONFIG)
+        )
+
+
+def _list_apis(client, region, key_id):
+    cached = _GATEWAY_CACHE.get((region, key_id))
+    if cached is not None and monotonic() - cached[0] < _GATEWAY_CACHE_TTL:
+        return cached[1]
+    apis = ApiGateway.get_gateways(client)
+    _GATEWAY_CACHE[(region, key_id)] = (monotonic(), apis)
+    return apis
+
+
+def _invalidate_apis(region, key_id):
+    _GATEWAY_CACHE.pop((region, key_id), None)
+
+
+def _site_path(url):
+    # Strip protocol and host from URL, keeping path and query string (which
+    # may follow the host directly, in URLs that weren't normalised by requests)
+    split_url = urlsplit(url)
+    site_path = split_url.path[1:]
+    if split_url.query:
+        site_path += "?" + split_url.query
+    return site_path
+
+
+def _openapi_spec(title, site):
+    # Proxy every method on "/" and "/{proxy+}" to site, passing our
+    # X-My-X-Forwarded-For header on as X-Forwarded-For
+    def proxy_method(uri, parameters, request_parameters):
+        return {
+            "x-amazon-apigateway-any-method": {
+                "parameters": parameters + [
+                    {"name": "X-My-X-Forwarded-For", "in": "header", "required": True, "schema": {"type": "string"}}
+                ],
+                "x-amazon-apigateway-integration": {
+                    "type": "http_proxy",
+                    "httpMethod": "ANY",
+                    "uri": uri,
+                    "connectionType": "INTERNET",
+                    "passthroughBehavior": "when_no_match",
+                    "requestParameters": {
+                        **request_parameters,
+                        "integration.request.header.X-Forwarded-For": "method.request.header.X-My-X-Forwarded-For"
+                    }
+                }
+            }
+        }
+
+    spec = {
+        "openapi": "3.0.1",
+        "info": {
+            "title": title,
+            "version": "1.0"
+        },
+        "paths": {
+            "/": proxy_method(site, [], {}),
+            "/{proxy+}": proxy_method(
+                f"{site}/{{proxy}}",
+                [{"name": "proxy", "in": "path", "required": True, "schema": {"type": "string"}}],
+                {"integration.request.path.proxy": "method.request.path.proxy"}
+            )
+        }
+    }
+    return json.dumps(spec).encode()
+
+
+def _random_ip():
+    # Draw randomness for a whole batch of addresses in one os.urandom call
+    try:
+        return _xff_local.pool.pop()
+    except (AttributeError, IndexError):
+        buf = os.urandom(4 * _XFF_BATCH_SIZE)
+        _xff_local.pool = [socket.inet_ntoa(buf[i:i + 4]) for i in range(0, len(buf), 4)]
+        return _xff_local.pool.pop()
+
+
+def _reset_xff_pool():
+    # Forked children would otherwise send the same addresses as their parent
+    _xff_local.pool = []
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_xff_pool)
+
+
+def _valid_cache_entry(entry):
+    return isinstance(entry, list) and len(entry) == 2 and isinstance(entry[0], str) and isinstance(entry[1], (int, float))
+
+
+def _load_cache():
+    try:
+        with open(ENDPOINT_CACHE_PATH) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # Drop anything a stray or hand-edited file has in the wrong shape
+    if not isinstance(cache, dict):
+        return {}
+    return {
+        api_name: {
+            key_id: {
+                region: entry
+                for region, entry in regions.items()
+                if _valid_cache_entry(entry)
+            }
+            for key_id, regions in scopes.items()
+            if isinstance(regions, dict)
+        }
+        for api_name, scopes in cache.items()
+        if isinstance(scopes, dict)
+    }
+
+
+def _cached_regions(cache, api_name, key_id):
+    # Endpoints for api_name made with the given access key
+    return cache.get(api_name, {}).get(key_id or "", {})
+
+
+def _save_cache(cache):
+    # Write to a temporary file of our own and move it into place, so readers
+    # only ever see a complete cache. This doesn't lock out other processes,
+    # so ones updating the cache at the same time can lose each other's changes.
+    cache_dir = os.path.dirname(ENDPOINT_CACHE_PATH)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, ENDPOINT_CACHE_PATH)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def _update_cache(api_name, key_id, entries):
+    # Set each region's entry, or remove it if given None
+    with _ENDPOINT_CACHE_LOCK:
+        cache = _load_cache()
+        scopes = cache.setdefault(api_name, {})
+        regions = scopes.setdefault(key_id or "", {})
+        for region, entry in entries.items():
+            if entry is None:
+                regions.pop(region, None)
+            else:
+                regions[region] = entry
+        if not regions:
+            del scopes[key_id or ""]
+        if not scopes:
+            del cache[api_name]
+        _save_cache(cache)
+
+
 # Inherits from HTTPAdapter so that we can edit each request before sending
 class ApiGateway(rq.adapters.HTTPAdapter):
 
-    def __init__(self, site, regions=DEFAULT_REGIONS, access_key_id=None, access_key_secret=None, verbose=True, **kwargs):
+    def __init__(self, site, regions=DEFAULT_REGIONS, access_key_id=None, access_key_secret=None, verbose=True, cache_endpoints=True, rotation="sticky", sticky_count=16, forward_xff=True, use_import=True, **kwargs):
+        if rotation not in ROTATIONS:
+            raise ValueError(f"Unknown rotation '{rotation}', must be one of: {', '.join(ROTATIONS)}")
+        if sticky_count < 1:
+            raise ValueError(f"sticky_count must be at least 1, got {sticky_count}")
+        # Requests are spread over one endpoint host per region, so keep a pool
+        # for every region and allow plenty of keep-alive connections in each
+        kwargs.setdefault("pool_connections", max(rq.adapters.DEFAULT_POOLSIZE, len(regions)))
+        kwargs.setdefault("pool_maxsize", 64)
         super().__init__(**kwargs)
         # Set simple params from constructor
         if site.endswith("/"):
@@ -42,8 +277,34 @@ class ApiGateway(rq.adapters.HTTPAdapter):
         self.access_key_id = access_key_id
         self.access_key_secret = access_key_secret
         self.api_name = site + " - IP Rotate API"
+        # "scheme://host" of our site as requests normalises it, so send() can
+        # slice the path straight out of request URLs
+        split_site = urlsplit(self.site)
+        self._site_prefix = f"{split_site.scheme.lower()}://{split_site.netloc.lower()}"
+        self._site_prefix_len = len(self._site_prefix)
+        self._api_name_manual = self.api_name + " (Manual Deletion Required)"
+        # API definitions for new gateways, by name
+        self._openapi_specs = {
+            name: _openapi_spec(name, self.site)
+            for name in (self.api_name, self._api_name_manual)
+        }
         self.regions = regions
         self.verbose = verbose
+        self.cache_endpoints = cache_endpoints
+        self.rotation = rotation
+        self.sticky_count = sticky_count
+        self.forward_xff = forward_xff
+        self.use_import = use_import
+        self._rng = Random()
+        # IDs of every API in each region that shutdown() would delete, as seen
+        # by the listing in init_gateway. Lets shutdown() skip listing again.
+        self._gateway_ids = {}
+        # Thread pool for per-region AWS calls, see get_executor()
+        self._executor = None
+        # Set for gateways created through ApiGateway.session()
+        self._shutdown_on_close = False
+        # No endpoints until started
+        self.set_endpoints([])
 
     # Enter and exit blocks to allow "with" clause
     def __enter__(self):
@@ -53,41 +314,82 @@ class ApiGateway(rq.adapters.HTTPAdapter):
     def __exit__(self, type, value, traceback):
         self.shutdown()
 
+    @classmethod
+    def session(cls, site, regions=DEFAULT_REGIONS, **kwargs):
+        # Start a gateway with a large connection pool and mount it on a new
+        # session, so every thread using the session shares the one pool. The
+        # gateway is shut down when the session is closed.
+        kwargs.setdefault("pool_maxsize", max(64, len(regions) * 8))
+        gateway = cls(site, regions=regions, **kwargs)
+        gateway.start()
+        gateway._shutdown_on_close = True
+        session = rq.Session()
+        session.mount(gateway.site, gateway)
+        return session
+
+    def close(self):
+        super().close()
+        if self._shutdown_on_close:
+            self._shutdown_on_close = False
+            self.shutdown()
+
+    def init_poolmanager(self, connections, maxsize, block=rq.adapters.DEFAULT_POOLBLOCK, **pool_kwargs):
+        pool_kwargs.setdefault("socket_options", _SOCKET_OPTIONS)
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+
     def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
-        # Get random endpoint
-        endpoint = choice(self.endpoints)
+        request.url = self.route(request.url, request.headers)
+        # Run original python requests send function
+        return super().send(request, stream, timeout, verify, cert, proxies)
+
+    def route(self, url, headers):
+        # Get next endpoint (rotation fails on an empty endpoint list)
+        try:
+            url_prefix, endpoint = self.next_route()
+        except (ValueError, StopIteration):
+            raise RuntimeError("ApiGateway has no endpoints, call start() before sending requests.") from None
         # Replace URL with our endpoint
-        protocol, site = request.url.split("://", 1)
-        site_path = site.split("/", 1)[1]
-        request.url = "https://" + endpoint + "/ProxyStage/" + site_path
+        n = self._site_prefix_len
+        if url.startswith(self._site_prefix) and url[n:n + 1] in ("/", ""):
+            site_path = url[n + 1:]
+        else:
+            site_path = _site_path(url)
         # Replace host with endpoint host
-        request.headers["Host"] = endpoint
-        # Auto generate random X-Forwarded-For if doesn't exist.
+        headers["Host"] = endpoint
+        # Keep the connection to the endpoint open for later requests
+        if headers.get("Connection", "").lower() == "close":
+            del headers["Connection"]
+        # Auto generate random X-Forwarded-For if doesn't exist (or isn't to be forwarded).
         # Otherwise AWS forwards true IP address in X-Forwarded-For header
-        x_forwarded_for = request.headers.get("X-Forwarded-For")
+        x_forwarded_for = None
+        if self.forward_xff:
+            x_forwarded_for = headers.pop("X-Forwarded-For", None)
         if x_forwarded_for is None:
-            x_forwarded_for = ipaddress.IPv4Address._string_from_ip_int(randint(0, MAX_IPV4))
+            x_forwarded_for = _random_ip()
         # Move "X-Forwarded-For" to "X-My-X-Forwarded-For". This then gets converted back
-        # within the gateway.
-        request.headers.pop("X-Forwarded-For", None)
-        request.headers["X-My-X-Forwarded-For"] = x_forwarded_for
-        # Run original python requests send function
-        return super().send(request, stream, timeout, verify, cert, proxies)
+        # within the gateway (replacing any X-Forwarded-For we didn't remove).
+        headers["X-My-X-Forwarded-For"] = x_forwarded_for
+        return url_prefix + site_path
+
+    def aio(self, **kwargs):
+        # asyncio session sending requests through this gateway's endpoints
+        return AioSession(self, **kwargs)
+
+    def get_client(self, region):
+        # Shared, cached API Gateway client for region and our credentials
+        return _get_client(region, self.access_key_id, self.access_key_secret)
 
     def init_gateway(self, region, force=False, require_manual_deletion=False):
+        from botocore.exceptions import ClientError
         # Init client
-        session = boto3.session.Session()
-        awsclient = session.client(
-            "apigateway",
-            region_name=region,
-            aws_access_key_id=self.access_key_id,
-            aws_secret_access_key=self.access_key_secret
-        )
+        awsclient = self.get_client(region)
+        # Without a listing we can't know every API shutdown() should delete
+        self._gateway_ids.pop(region, None)
         # If API gateway already exists for host, return pre-existing endpoint
         if not force:
             try:
-                current_apis = ApiGateway.get_gateways(awsclient)
-            except botocore.exceptions.ClientError as e:
+                current_apis = _list_apis(awsclient, region, self.access_key_id)
+            except ClientError as e:
                 if e.response["Error"]["Code"] == "UnrecognizedClientException":
                     if self.verbose:
                         print(f"Could not create region (some regions require manual enabling): {region}")
@@ -97,8 +399,10 @@ class ApiGateway(rq.adapters.HTTPAdapter):
                 else:
                     raise e
 
+            gateway_ids = [api["id"] for api in current_apis if api.get("name") == self.api_name]
             for api in current_apis:
                 if "name" in api and api["name"].startswith(self.api_name):
+                    self._gateway_ids[region] = gateway_ids
                     return {
                         "success": True,
                         "endpoint": f"{api['id']}.execute-api.{region}.amazonaws.com",
@@ -106,82 +410,39 @@ class ApiGateway(rq.adapters.HTTPAdapter):
                     }
 
         # Create simple rest API resource
-        new_api_name = self.api_name
-        if require_manual_deletion:
-            new_api_name += " (Manual Deletion Required)"
-        create_api_response = awsclient.create_rest_api(
-            name=new_api_name,
-            endpointConfiguration={
-                "types": [
-                    "REGIONAL",
-                ]
-            }
-        )
-
-        # Get ID for new resource
-        get_resource_response = awsclient.get_resources(
-            restApiId=create_api_response["id"]
-        )
-        rest_api_id = create_api_response["id"]
-
-        # Create "Resource" (wildcard proxy path)
-        create_resource_response = awsclient.create_resource(
-            restApiId=create_api_response["id"],
-            parentId=get_resource_response["items"][0]["id"],
-            pathPart="{proxy+}"
-        )
-
-        # Allow all methods to new resource
-        awsclient.put_method(
-            restApiId=create_api_response["id"],
-            resourceId=get_resource_response["items"][0]["id"],
-            httpMethod="ANY",
-            authorizationType="NONE",
-            requestParameters={
-                "method.request.path.proxy": True,
-                "method.request.header.X-My-X-Forwarded-For": True
-            }
-        )
-
-        # Make new resource route traffic to new host
-        awsclient.put_integration(
-            restApiId=create_api_response["id"],
-            resourceId=get_resource_response["items"][0]["id"],
-            type="HTTP_PROXY",
-            httpMethod="ANY",
-            integrationHttpMethod="ANY",
-            uri=self.site,
-            connectionType="INTERNET",
-            requestParameters={
-                "integration.request.path.proxy": "method.request.path.proxy",
-                "integration.request.header.X-Forwarded-For": "method.request.header.X-My-X-Forwarded-For"
-            }
-        )
-
-        awsclient.put_method(
-            restApiId=create_api_response["id"],
-            resourceId=create_resource_response["id"],
-            httpMethod="ANY",
-            authorizationType="NONE",
-            requestParameters={
-                "method.request.path.proxy": True,
-                "method.request.header.X-My-X-Forwarded-For": True
-            }
-        )
-
-        awsclient.put_integration(
-            restApiId=create_api_response["id"],
-            resourceId=create_resource_response["id"],
-            type="HTTP_PROXY",
-            httpMethod="ANY",
-            integrationHttpMethod="ANY",
-            uri=f"{self.site}/{{proxy}}",
-            connectionType="INTERNET",
-            requestParameters={
-                "integration.request.path.proxy": "method.request.path.proxy",
-                "integration.request.header.X-Forwarded-For": "method.request.header.X-My-X-Forwarded-For"
-            }
-        )
+        new_api_name = self._api_name_manual if require_manual_deletion else self.api_name
+        if self.use_import:
+            # Create the API with its root and wildcard proxy resources, allowing
+            # all methods and routing their traffic to the new host, in a single call
+            rest_api_id = awsclient.import_rest_api(
+                body=self._openapi_specs[new_api_name],
+                parameters={
+                    "endpointConfigurationTypes": "REGIONAL"
+                }
+            )["id"]
+        else:
+            rest_api_id = awsclient.create_rest_api(
+                name=new_api_name,
+                endpointConfiguration={
+                    "types": [
+                        "REGIONAL",
+                    ]
+                }
+            )["id"]
+        _invalidate_apis(region, self.access_key_id)
+        if not force:
+            if not require_manual_deletion:
+                gateway_ids.append(rest_api_id)
+            self._gateway_ids[region] = gateway_ids
+
+        if not self.use_import:
+            # Define the root and wildcard proxy resources, allowing all methods and
+            # routing their traffic to the new host
+            awsclient.put_rest_api(
+                restApiId=rest_api_id,
+                mode="overwrite",
+                body=self._openapi_specs[new_api_name]
+            )
 
         # Creates deployment resource, so that our API to be callable
         awsclient.create_deployment(
@@ -220,81 +481,153 @@ class ApiGateway(rq.adapters.HTTPAdapter):
 
         return gateways
 
-    def delete_gateway(self, region, endpoints=None):
+    def delete_gateway(self, region, endpoints=None, api_ids=None):
+        from botocore.exceptions import ClientError
         # Create client
-        session = boto3.session.Session()
-        awsclient = session.client('apigateway',
-                                   region_name=region,
-                                   aws_access_key_id=self.access_key_id,
-                                   aws_secret_access_key=self.access_key_secret
-                                   )
+        awsclient = self.get_client(region)
         # Extract endpoint IDs from given endpoints
-        endpoint_ids = []
+        endpoint_ids = None
         if endpoints is not None:
-            for endpoint in endpoints:
-                endpoint_ids.append(endpoint.split(".")[0])
-        # Get all gateway apis (or skip if we don't have permission)
-        try:
-            apis = ApiGateway.get_gateways(awsclient)
-        except botocore.exceptions.ClientError as e:
-            if e.response["Error"]["Code"] == "UnrecognizedClientException":
-                return 0
-        # Delete APIs matching target name
-        api_iter = 0
-        deleted = []
-        while api_iter < len(apis):
-            api = apis[api_iter]
-            # Check if hostname matches
-            if "name" in api and self.api_name == api["name"]:
-                # Attempt delete
-                try:
-                    # If endpoints list is given, only delete if within list
-                    if endpoints is not None and api["id"] not in endpoint_ids:
-                        api_iter += 1
-                        continue
-                    success = awsclient.delete_rest_api(restApiId=api["id"])
-                    if success:
-                        deleted.append(api["id"])
-                    else:
-                        if self.verbose:
-                            print(f"Failed to delete API {api['id']}.")
-                except botocore.exceptions.ClientError as e:
-                    # If timeout, retry
-                    err_code = e.response["Error"]["Code"]
-                    if err_code == "TooManyRequestsException":
-                        sleep(1)
-                        continue
-                    else:
-                        if self.verbose:
-                            print(f"Failed to delete API {api['id']}.")
-            api_iter += 1
+            endpoint_ids = {endpoint.split(".", 1)[0] for endpoint in endpoints}
+        # Get IDs of all gateway apis matching target name, unless already known
+        # (or skip if we don't have permission)
+        if api_ids is None:
+            try:
+                apis = _list_apis(awsclient, region, self.access_key_id)
+            except ClientError as e:
+                if e.response["Error"]["Code"] == "UnrecognizedClientException":
+                    return []
+                else:
+                    raise e
+            api_ids = [api["id"] for api in apis if "name" in api and self.api_name == api["name"]]
+        # If endpoints list is given, only delete if within list
+        matches = [api_id for api_id in api_ids if endpoint_ids is None or api_id in endpoint_ids]
+        # Delete matching APIs one at a time, as AWS only allows one delete per
+        # account every 30 seconds, so more threads would only compete for it
+        deleted = [api_id for api_id in matches if self.delete_api(awsclient, api_id)]
+        if deleted:
+            _invalidate_apis(region, self.access_key_id)
+            if region in self._gateway_ids:
+                deleted_ids = set(deleted)
+                self._gateway_ids[region] = [api_id for api_id in self._gateway_ids[region] if api_id not in deleted_ids]
         return deleted
 
+    def delete_api(self, client, api_id):
+        from botocore.exceptions import ClientError
+        # botocore retries throttled calls a few times itself, but with only one
+        # delete allowed every 30 seconds, keep waiting for a turn until the deadline
+        deadline = monotonic() + _DELETE_DEADLINE
+        while True:
+            try:
+                if client.delete_rest_api(restApiId=api_id):
+                    return True
+                break
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "TooManyRequestsException" or monotonic() >= deadline:
+                    break
+            sleep(_DELETE_RETRY_DELAY)
+        if self.verbose:
+            print(f"Failed to delete API {api_id}.")
+        return False
+
+    def try_region(self, method, region, failed, **kwargs):
+        # Run method for region, returning (result, error) with failed as the
+        # result instead of raising, so that every other region still finishes
+        # before the caller raises the error
+        try:
+            return method(region, **kwargs), None
+        except Exception as e:
+            if self.verbose:
+                print(f"Error in region {region}: {e}")
+            return failed, e
+
+    def get_executor(self):
+        # One thread per region, created on first use and shared by start() and shutdown()
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(self.regions)))
+        return self._executor
+
+    def set_endpoints(self, endpoints):
+        self.endpoints = endpoints
+        # (URL prefix, host) for each endpoint, so send() only picks one and
+        # appends the request path
+        self._routing = tuple((f"https://{endpoint}/ProxyStage/", endpoint) for endpoint in endpoints)
+        self._n = len(self._routing)
+        # Routes shared out to threads by the sticky rotation
+        offset = self._rng.randrange(self._n) if self._n else 0
+        self._route_cycle = itertools.cycle(self._routing[offset:] + self._routing[:offset])
+        # Per-thread rotation state
+        self._local = threading.local()
+
+    def next_route(self):
+        if self.rotation == "random":
+            return self._routing[self._rng.randrange(self._n)]
+        local = self._local
+        if self.rotation == "sticky":
+            # Reuse this thread's route (and so its warm connection) for
+            # sticky_count requests before moving on to the next one
+            remaining = getattr(local, "remaining", 0)
+            if remaining:
+                local.remaining = remaining - 1
+                return local.route
+            local.route = next(self._route_cycle)
+            local.remaining = self.sticky_count - 1
+            return local.route
+        try:
+            return next(local.routes)
+        except AttributeError:
+            # First request from this thread. Start from a random endpoint, so
+            # that threads spread out over the regions.
+            offset = self._rng.randrange(self._n)
+            local.routes = itertools.cycle(self._routing[offset:] + self._routing[:offset])
+            return next(local.routes)
+
     def start(self, force=False, require_manual_deletion=False, endpoints=[]):
         # If endpoints given already, assign and continue
         if len(endpoints) > 0:
-            self.endpoints = endpoints
+            self.set_endpoints(endpoints)
             return endpoints
 
         # Otherwise, start/locate new endpoints
         if self.verbose:
             print(f"Starting API gateway{'s' if len(self.regions) > 1 else ''} in {len(self.regions)} regions.")
-        self.endpoints = []
         new_endpoints = 0
-
-        # Setup multithreading object
-        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-            futures = []
-            # Send each region creation to its own thread
-            for region in self.regions:
-                futures.append(executor.submit(self.init_gateway, region=region, force=force, require_manual_deletion=require_manual_deletion))
+        first_error = None
+
+        # Reuse endpoints saved by a recent run, so their regions need no AWS calls
+        cached = {}
+        if self.cache_endpoints and not force:
+            now = time()
+            cached = {
+                region: endpoint
+                for region, (endpoint, created) in _cached_regions(_load_cache(), self.api_name, self.access_key_id).items()
+                if region in self.regions and now - created < _ENDPOINT_CACHE_TTL
+            }
+        self.endpoints = list(cached.values())
+        regions = [region for region in self.regions if region not in cached]
+
+        # Send each region creation to its own thread
+        if regions:
+            results = self.get_executor().map(
+                lambda region: self.try_region(self.init_gateway, region, {"success": False}, force=force, require_manual_deletion=require_manual_deletion),
+                regions
+            )
             # Get thread outputs
-            for future in concurrent.futures.as_completed(futures):
-                result = future.result()
+            found = []
+            for result, error in results:
+                if error is not None and first_error is None:
+                    first_error = error
                 if result["success"]:
-                    self.endpoints.append(result["endpoint"])
+                    found.append(result["endpoint"])
                     if result["new"]:
                         new_endpoints += 1
+            self.endpoints += found
+            if self.cache_endpoints and found:
+                now = time()
+                _update_cache(self.api_name, self.access_key_id, {endpoint.split(".")[2]: [endpoint, now] for endpoint in found})
+        self.set_endpoints(self.endpoints)
+        if not self.endpoints:
+            raise RuntimeError(f"No endpoints could be created for '{self.site}', check AWS credentials and regions.") from first_error
 
         if self.verbose:
             print(f"Using {len(self.endpoints)} endpoints with name '{self.api_name}' ({new_endpoints} new).")
@@ -303,16 +636,64 @@ class ApiGateway(rq.adapters.HTTPAdapter):
     def shutdown(self, endpoints=None):
         if self.verbose:
             print(f"Deleting gateway{'s' if len(self.regions) > 1 else ''} for site '{self.site}'.")
-        futures = []
-        # Setup multithreading object
-        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-            # Send each region deletion to its own thread
-            for region in self.regions:
-                futures.append(executor.submit(self.delete_gateway, region=region, endpoints=endpoints))
+        # Send each region deletion to its own thread, then release the threads
+        executor = self.get_executor()
+        try:
+            results = executor.map(
+                lambda region: self.try_region(self.delete_gateway, region, [], endpoints=endpoints, api_ids=self._gateway_ids.get(region)),
+                self.regions
+            )
             # Check outputs
             deleted = []
-            for future in concurrent.futures.as_completed(futures):
-                deleted += future.result()
+            errors = []
+            for result, error in results:
+                deleted += result
+                if error is not None:
+                    errors.append(error)
+        finally:
+            executor.shutdown()
+            self._executor = None
+        # Forget cached endpoints that no longer exist
+        if self.cache_endpoints and deleted:
+            _update_cache(self.api_name, self.access_key_id, {
+                region: None
+                for region, (endpoint, created) in _cached_regions(_load_cache(), self.api_name, self.access_key_id).items()
+                if endpoint.split(".")[0] in deleted
+            })
         if self.verbose:
             print(f"Deleted {len(deleted)} endpoints with for site '{self.site}'.")
+        # Gateways left in a failed region keep running, so don't fail silently
+        if errors:
+            raise errors[0]
         return deleted
+
+
+# Sends requests through a started ApiGateway using aiohttp (an optional dependency)
+class AioSession:
+
+    def __init__(self, gateway, **kwargs):
+        self.gateway = gateway
+        self.kwargs = kwargs
+        self.session = None
+
+    async def __aenter__(self):
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImportError("aiohttp is required for asyncio support: pip install requests-ip-rotator[aio]")
+        # Keep connections (and resolved endpoint hosts) around between requests.
+        # Made on every entry, as closing the session also closes its connector.
+        kwargs = dict(self.kwargs)
+        if "connector" not in kwargs:
+            kwargs["connector"] = aiohttp.TCPConnector(ttl_dns_cache=300, enable_cleanup_closed=True)
+        self.session = aiohttp.ClientSession(**kwargs)
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        await self.session.close()
+
+    def request(self, method, url, headers=None, **kwargs):
+        # Can be awaited, or used with "async with", like aiohttp's own request
+        headers = rq.structures.CaseInsensitiveDict(headers or {})
+        url = self.gateway.route(str(url), headers)
+        return self.session.request(method, url, headers=dict(headers), **kwargs)
@@ -34,5 +34,6 @@ setup(
     ],
     packages=["requests_ip_rotator"],
     include_package_data=True,
-    install_requires=["requests", "boto3"]
+    install_requires=["requests", "botocore"],
+    extras_require={"aio": ["aiohttp"]}
 )